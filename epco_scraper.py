@@ -1,11 +1,30 @@
+import asyncio
+import calendar
+import codecs
 import datetime as dt
+import json
+import os
 import re
+import shutil
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email.utils import formatdate
 from io import BytesIO
-from pathlib import Path
+from tempfile import SpooledTemporaryFile
 from urllib.parse import urljoin
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from zipfile import ZipFile
-import chardet
+
+try:
+    from cchardet import detect
+except ImportError:
+    from charset_normalizer import detect
 
 
 # Earliest available year for each region based on existing CSV files.
@@ -24,6 +43,44 @@ import chardet
 #
 # TODO: Fill in data for earlier years where available.
 
+# Paths of the files published by each area relative to its base URL,
+# formatted with the requested date.
+_TOHOKU_CSV_TMPL = "common/demand/juyo_{:%Y}_tohoku.csv"
+_SHIKOKU_CSV_TMPL = "juyo_shikoku_{:%Y}.csv"
+_CHUGOKU_CSV_TMPL = "juyo-{:%Y}.csv"
+_KYUSHU_CSV_TMPL = "juyo-hourly-{:%Y%m%d}.csv"
+_OKINAWA_CSV_TMPL = "juyo_10_{:%Y%m%d}.csv"
+_HOKURIKU_CSV_TMPL = "juyo_05_{:%Y%m%d}.csv"
+_TOKYO_CSV_TMPL = "html/images/juyo-{:%Y}.csv"
+_TOKYO_ZIP_TMPL = "html/images/{:%Y%m}_power_usage.zip"
+_CHUBU_ZIP_TMPL = "/denki_yoho_content_data/download_csv/{:%Y%m}_power_usage.zip"
+_KANSAI_ZIP_TMPL = "yamasou/{:%Y%m}_jisseki.zip"
+# Also formatted with the quarter's first and last month.
+_HOKKAIDO_ZIP_TMPL = "area/data/zip/{0:%Y}{1:02d}-{2:02d}_hokkaido_denkiyohou.zip"
+# Tokyo published yearly CSV files before switching to monthly archives.
+_TOKYO_ZIP_START = dt.date(2022, 4, 1)
+
+# HTTP statuses retried with exponential backoff by both downloaders.
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Connect and read timeouts in seconds for synchronous requests.
+_TIMEOUT = (5, 30)
+# Seconds a fetched landing page is reused before it is downloaded again.
+_LANDING_TTL = 600
+# Leading bytes inspected when the encoding has to be detected.
+_SNIFF_SIZE = 64 * 1024
+# Chunk size for streamed downloads.
+_CHUNK_SIZE = 64 * 1024
+# ZIP archives larger than this are spooled to disk while downloading.
+_SPOOL_SIZE = 8 * 1024 * 1024
+
+# A blank line in LF-terminated UTF-8: ASCII whitespace and ideographic
+# spaces (U+3000) only, matching what ``str.strip`` removes in practice.
+_BLANK = rb"(?:[ \t\r\x0b\x0c\x1c-\x1f]|\xe3\x80\x80)*\n"
+_BLANK_LINE = re.compile(rb"^" + _BLANK, re.MULTILINE)
+_NON_ASCII = re.compile(rb"[\x80-\xff]")
+# A run of consecutive blank lines.
+_BLANK_RUN = re.compile(rb"^(?:" + _BLANK + rb")+", re.MULTILINE)
+
 
 class epco:
     """Scraper for EPCO electricity usage data.
@@ -61,7 +118,30 @@ class epco:
         "okinawa": "https://www.okiden.co.jp/denki2/",
     }
 
-    def juyo(self, date, area="hokkaido"):
+    # Sent with every request; some sites reject the default user agents.
+    _HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+    def __init__(self):
+        # Share one pooled session so repeated downloads from the same host
+        # reuse their keep-alive connections instead of new TLS handshakes.
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=sorted(_RETRY_STATUSES),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=32)
+        self._session = requests.Session()
+        self._session.headers.update(self._HEADERS)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # Landing pages keyed by base URL as ``(expires_at, html, last_modified)``.
+        self._landing_pages = {}
+        # Held while a landing page is fetched, so concurrent threads wait for
+        # that fetch instead of starting their own.
+        self._landing_lock = threading.Lock()
+
+    def juyo(self, date, area="hokkaido", force=False):
         """Download and extract electricity usage data.
 
         Parameters
@@ -73,6 +153,13 @@ class epco:
             Electricity area. Supports ``"hokkaido"``, ``"tohoku"``, ``"tokyo"``,
             ``"chubu"``, ``"chugoku"``, ``"kansai"``, ``"hokuriku"``,
             ``"shikoku"``, ``"kyushu"``, and ``"okinawa"``.
+        force : bool, optional
+            Download even if the files were already saved after the period
+            they cover had ended. Such files no longer change, so by default
+            they are returned without contacting the server. Other saved
+            files are only downloaded again if the server reports a change
+            since they were saved. Files without a download record, such as
+            those committed to the repository, are always downloaded.
 
         Returns
         -------
@@ -94,224 +181,562 @@ class epco:
             empty lines removed. For the Okinawa area files are saved under
             ``csv/juyo/oki/YYYY`` with empty lines removed.
         """
-        if isinstance(date, str):
-            date = dt.date.fromisoformat(date)
-        elif isinstance(date, dt.datetime):
-            date = date.date()
-        elif not isinstance(date, dt.date):
-            raise TypeError("date must be a date, datetime, or ISO format string")
-
-        base_url = self.BASE_URLS.get(area)
-        if base_url is None:
+        date = _to_date(date)
+        spec, url, target_dir, name = self._locate(date, area)
+        record = None if force else _read_marker(target_dir, name)
+        if record is not None and _is_final(record, spec.period_end(date)):
+            return record["paths"]
+
+        headers = _conditional_headers(record)
+        with self._session.get(url, headers=headers, stream=True, timeout=_TIMEOUT) as res:
+            res.raise_for_status()
+            if res.status_code == 304:
+                if _files_present(record["paths"]):
+                    return _revalidated(target_dir, name, record)
+                # The saved files were removed while the request was made.
+                return self.juyo(date, area, force=True)
+            last_modified = res.headers.get("Last-Modified")
+            if not name.endswith(".zip"):
+                return _save(spec.cleanup, res.content, target_dir, name, last_modified)
+
+            # Stream archives to a temporary file instead of buffering the
+            # whole response body in memory.
+            with SpooledTemporaryFile(max_size=_SPOOL_SIZE) as archive:
+                for chunk in res.iter_content(_CHUNK_SIZE):
+                    archive.write(chunk)
+                archive.seek(0)
+                return _save(spec.cleanup, archive, target_dir, name, last_modified)
+
+    async def juyo_async(self, session, date, area="hokkaido", force=False):
+        """Asynchronous variant of :meth:`juyo` using an ``aiohttp`` session.
+
+        The download is awaited on ``session`` while locating the dataset and
+        the blocking ZIP/CSV processing run in worker threads. Responses with
+        status 429 or 5xx are retried with exponential backoff.
+
+        Parameters
+        ----------
+        session : aiohttp.ClientSession
+            Session used for the download.
+        date : str | datetime.date | datetime.datetime
+            Date used to determine which dataset to download.
+        area : str, optional
+            Electricity area, see :meth:`juyo`.
+        force : bool, optional
+            Download even if finished files were already saved, see
+            :meth:`juyo`.
+
+        Returns
+        -------
+        list[str]
+            Paths to the extracted CSV files.
+        """
+        return await self._juyo_async(session, date, area, force, {})
+
+    async def _juyo_async(self, session, date, area, force, downloads):
+        """Run :meth:`juyo_async`, sharing the download tasks in ``downloads``.
+
+        ``downloads`` maps URLs to download tasks, so dates mapping to the
+        same file share a single download.
+        """
+        date = _to_date(date)
+        if self._area_spec(date, area).landing_page is None:
+            spec, url, target_dir, name = self._locate(date, area)
+        else:
+            # Checking the landing page may block on a download.
+            located = await asyncio.to_thread(self._locate, date, area)
+            spec, url, target_dir, name = located
+        record = None if force else _read_marker(target_dir, name)
+        if record is not None and _is_final(record, spec.period_end(date)):
+            return record["paths"]
+
+        task = downloads.get(url)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._download_async(session, spec, url, target_dir, name, record)
+            )
+            downloads[url] = task
+        return list(await asyncio.shield(task))
+
+    async def _download_async(self, session, spec, url, target_dir, name, record):
+        content, last_modified = await _fetch_async(
+            session, url, _conditional_headers(record)
+        )
+        if content is None:
+            if _files_present(record["paths"]):
+                return _revalidated(target_dir, name, record)
+            # The saved files were removed while the request was made.
+            return await self._download_async(
+                session, spec, url, target_dir, name, None
+            )
+        return await asyncio.to_thread(
+            _save, spec.cleanup, content, target_dir, name, last_modified
+        )
+
+    async def juyo_batch(self, dates, area="hokkaido", limit=32, force=False):
+        """Download datasets for many dates concurrently.
+
+        Dates sharing one yearly, quarterly or monthly file download it only
+        once.
+
+        Parameters
+        ----------
+        dates : iterable
+            Dates accepted by :meth:`juyo`.
+        area : str, optional
+            Electricity area, see :meth:`juyo`.
+        limit : int, optional
+            Maximum number of requests in flight.
+        force : bool, optional
+            Download even if finished files were already saved, see
+            :meth:`juyo`.
+
+        Returns
+        -------
+        list[list[str] | BaseException]
+            Extracted paths for each date, in order. Failed dates yield the
+            raised exception instead.
+        """
+        sem = asyncio.Semaphore(limit)
+        # Download tasks by URL, shared by the dates of this batch only.
+        downloads = {}
+        connector = aiohttp.TCPConnector(limit_per_host=16, keepalive_timeout=60)
+        async with aiohttp.ClientSession(
+            connector=connector, headers=self._HEADERS
+        ) as session:
+
+            async def bounded(date):
+                async with sem:
+                    return await self._juyo_async(
+                        session, date, area, force, downloads
+                    )
+
+            return await asyncio.gather(
+                *(bounded(date) for date in dates), return_exceptions=True
+            )
+
+    def _locate(self, date, area):
+        """Return the area spec, download URL, target directory and file name.
+
+        The file name is the published CSV or ZIP archive name.
+        """
+        spec = self._area_spec(date, area)
+        base_url = self.BASE_URLS[area]
+        href = spec.url_builder(date)
+        if spec.landing_page is not None:
+            html = self._fetch_landing(urljoin(base_url, spec.landing_page))
+            if href not in html:
+                raise ValueError(f"No data link found for {date}")
+
+        target_dir = f"csv/juyo/{spec.subdir}"
+        if spec.yearly:
+            target_dir = f"{target_dir}/{date.year}"
+        return spec, urljoin(base_url, href), target_dir, href.rsplit("/", 1)[-1]
+
+    def _area_spec(self, date, area):
+        """Return the :class:`AreaSpec` describing ``area``'s data for ``date``."""
+        if area not in self.BASE_URLS:
             raise ValueError(f"Unsupported area: {area}")
+        if area == "tokyo" and date < _TOKYO_ZIP_START:
+            return _TOKYO_YEARLY
+        return _AREA_HANDLERS[area]
+
+    def _fetch_landing(self, page_url):
+        """Return the HTML of ``page_url``, reusing recent fetches."""
+        with self._landing_lock:
+            return self._fetch_landing_locked(page_url)
+
+    def _fetch_landing_locked(self, page_url):
+        now = time.monotonic()
+        cached = self._landing_pages.get(page_url)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        headers = {}
+        if cached is not None and cached[2]:
+            # Revalidate the expired copy instead of downloading it again.
+            headers["If-Modified-Since"] = cached[2]
+        res = self._session.get(page_url, headers=headers, timeout=_TIMEOUT)
+        res.raise_for_status()
+        if res.status_code == 304:
+            html, last_modified = cached[1], cached[2]
+        else:
+            html, last_modified = res.text, res.headers.get("Last-Modified")
+        self._landing_pages[page_url] = (now + _LANDING_TTL, html, last_modified)
+        return html
 
-        year = date.year
 
-        if area == "tohoku":
-            csv_name = f"juyo_{year}_tohoku.csv"
-            csv_url = urljoin(base_url, f"common/demand/{csv_name}")
-            res = requests.get(csv_url, headers={"User-Agent": "Mozilla/5.0"})
-            res.raise_for_status()
+def _save(cleanup, content, target_dir, name, last_modified=None):
+    """Clean the downloaded CSV or ZIP ``content`` and write it to disk.
 
-            target_dir = Path("csv") / "juyo" / "toh"
-            target_dir.mkdir(parents=True, exist_ok=True)
-            dest_path = target_dir / csv_name
-
-            encoding = chardet.detect(res.content).get("encoding") or "shift_jis"
-            text = res.content.decode(encoding)
-            # Remove empty lines from the CSV text
-            lines = [line for line in text.splitlines() if line.strip()]
-            cleaned = "\n".join(lines) + "\n"
-            with open(dest_path, "w", encoding="utf-8") as dst:
-                dst.write(cleaned)
-            return [str(dest_path)]
-
-        if area == "shikoku":
-            csv_name = f"juyo_shikoku_{year}.csv"
-            csv_url = urljoin(base_url, csv_name)
-            res = requests.get(csv_url, headers={"User-Agent": "Mozilla/5.0"})
-            res.raise_for_status()
+    ``content`` holds the CSV bytes, or the ZIP archive as bytes or a
+    binary file object. ``cleanup`` is applied to the UTF-8 bytes of every
+    CSV file written. The paths written, the time of the download and the
+    server's ``last_modified`` header are recorded in a marker file next to
+    them so finished files can be skipped and others revalidated.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+
+    if not name.endswith(".zip"):
+        dest_path = f"{target_dir}/{name}"
+        cleaned = cleanup(_to_utf8(content)) or b"\n"
+        with open(dest_path, "wb") as dst:
+            dst.write(cleaned)
+        return _write_marker(target_dir, name, [dest_path], last_modified)
+
+    if isinstance(content, bytes):
+        content = BytesIO(content)
+    with ZipFile(content) as zf:
+        members = [member for member in zf.infolist() if not member.is_dir()]
+        # ZipFile serializes reads of the shared archive itself, but
+        # opening members concurrently is not thread-safe.
+        open_lock = threading.Lock()
+
+        def extract_one(member):
+            name = member.filename.rsplit("/", 1)[-1]
+            dest_path = f"{target_dir}/{name}"
+            with open_lock:
+                src = zf.open(member)
+            with src, open(dest_path, "wb") as dst:
+                if name.lower().endswith(".csv"):
+                    _write_cleaned(src, dst, cleanup)
+                else:
+                    # Anything other than CSV data is copied verbatim.
+                    shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+            return dest_path
 
-            target_dir = Path("csv") / "juyo" / "shi"
-            target_dir.mkdir(parents=True, exist_ok=True)
-            dest_path = target_dir / csv_name
-
-            encoding = chardet.detect(res.content).get("encoding") or "shift_jis"
-            text = res.content.decode(encoding)
-            lines = [line for line in text.splitlines() if line.strip()]
-            cleaned = "\n".join(lines) + "\n"
-            with open(dest_path, "w", encoding="utf-8") as dst:
-                dst.write(cleaned)
-            return [str(dest_path)]
-
-        if area == "chugoku":
-            csv_name = f"juyo-{year}.csv"
-            csv_url = urljoin(base_url, csv_name)
-            res = requests.get(csv_url, headers={"User-Agent": "Mozilla/5.0"})
-            res.raise_for_status()
+        extracted_files: list[str] = []
+        if members:
+            with ThreadPoolExecutor(max_workers=min(8, len(members))) as pool:
+                extracted_files = list(pool.map(extract_one, members))
 
-            target_dir = Path("csv") / "juyo" / "cgk" / f"{year}"
-            target_dir.mkdir(parents=True, exist_ok=True)
-            dest_path = target_dir / csv_name
-
-            encoding = chardet.detect(res.content).get("encoding") or "shift_jis"
-            text = res.content.decode(encoding)
-            lines = [line for line in text.splitlines() if line.strip()]
-            cleaned = "\n".join(lines) + "\n"
-            with open(dest_path, "w", encoding="utf-8") as dst:
-                dst.write(cleaned)
-            return [str(dest_path)]
-
-        if area == "kyushu":
-            csv_name = f"juyo-hourly-{date:%Y%m%d}.csv"
-            csv_url = urljoin(base_url, csv_name)
-            res = requests.get(csv_url, headers={"User-Agent": "Mozilla/5.0"})
-            res.raise_for_status()
+    return _write_marker(target_dir, name, extracted_files, last_modified)
 
-            target_dir = Path("csv") / "juyo" / "kyu" / f"{year}"
-            target_dir.mkdir(parents=True, exist_ok=True)
-            dest_path = target_dir / csv_name
-
-            encoding = chardet.detect(res.content).get("encoding") or "shift_jis"
-            text = res.content.decode(encoding)
-            lines = [line for line in text.splitlines() if line.strip()]
-            cleaned = "\n".join(lines) + "\n"
-            with open(dest_path, "w", encoding="utf-8") as dst:
-                dst.write(cleaned)
-            return [str(dest_path)]
-
-        if area == "okinawa":
-            csv_name = f"juyo_10_{date:%Y%m%d}.csv"
-            csv_url = urljoin(base_url, csv_name)
-            res = requests.get(csv_url, headers={"User-Agent": "Mozilla/5.0"})
-            res.raise_for_status()
 
-            target_dir = Path("csv") / "juyo" / "oki" / f"{year}"
-            target_dir.mkdir(parents=True, exist_ok=True)
-            dest_path = target_dir / csv_name
-
-            encoding = chardet.detect(res.content).get("encoding") or "shift_jis"
-            text = res.content.decode(encoding)
-            lines = [line for line in text.splitlines() if line.strip()]
-            cleaned = "\n".join(lines) + "\n"
-            with open(dest_path, "w", encoding="utf-8") as dst:
-                dst.write(cleaned)
-            return [str(dest_path)]
-
-        if area == "hokuriku":
-            csv_name = f"juyo_05_{date:%Y%m%d}.csv"
-            csv_url = urljoin(base_url, csv_name)
-            res = requests.get(csv_url, headers={"User-Agent": "Mozilla/5.0"})
-            res.raise_for_status()
+async def _fetch_async(session, url, headers=None, retries=5, backoff=0.5):
+    """Return the body and ``Last-Modified`` header of ``url``.
+
+    Responses with status 429 or 5xx are retried. The body is ``None`` when a
+    conditional request is answered with 304.
+    """
+    for attempt in range(retries + 1):
+        async with session.get(url, headers=headers) as resp:
+            if resp.status not in _RETRY_STATUSES or attempt == retries:
+                resp.raise_for_status()
+                last_modified = resp.headers.get("Last-Modified")
+                if resp.status == 304:
+                    return None, last_modified
+                return await resp.read(), last_modified
+        await asyncio.sleep(backoff * 2**attempt)
+
+
+def _quarter_months(date):
+    """Return the first and last month of the quarter containing ``date``.
+
+    Quarters cover January-March, April-June, and so on.
+    """
+    start_month = (date.month - 1) // 3 * 3 + 1
+    return start_month, start_month + 2
+
+
+def _hokkaido_path(date):
+    return _HOKKAIDO_ZIP_TMPL.format(date, *_quarter_months(date))
+
+
+def _month_end(year, month):
+    """Return the last day of ``month``."""
+    return dt.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _end_of_day(date):
+    return date
 
-            target_dir = Path("csv") / "juyo" / "hrk" / f"{year}"
-            target_dir.mkdir(parents=True, exist_ok=True)
-            dest_path = target_dir / csv_name
-
-            encoding = chardet.detect(res.content).get("encoding") or "shift_jis"
-            text = res.content.decode(encoding)
-            lines = [line for line in text.splitlines() if line.strip()]
-            cleaned = "\n".join(lines) + "\n"
-            with open(dest_path, "w", encoding="utf-8") as dst:
-                dst.write(cleaned)
-            return [str(dest_path)]
-
-        if area == "tokyo":
-            if date < dt.date(2022, 4, 1):
-                csv_name = f"juyo-{year}.csv"
-                csv_url = urljoin(base_url, f"html/images/{csv_name}")
-                res = requests.get(csv_url, headers={"User-Agent": "Mozilla/5.0"})
-                res.raise_for_status()
-
-                target_dir = Path("csv") / "juyo" / "tok"
-                target_dir.mkdir(parents=True, exist_ok=True)
-                dest_path = target_dir / csv_name
-
-                encoding = chardet.detect(res.content).get("encoding") or "shift_jis"
-                text = res.content.decode(encoding)
-                lines = [line for line in text.splitlines() if line.strip()]
-                cleaned = "\n".join(lines) + "\n"
-                with open(dest_path, "w", encoding="utf-8") as dst:
-                    dst.write(cleaned)
-                return [str(dest_path)]
-
-            filename = f"{year}{date.month:02d}_power_usage.zip"
-            zip_url = urljoin(base_url, f"html/images/{filename}")
-        elif area == "chubu":
-            filename = f"{year}{date.month:02d}_power_usage.zip"
-            zip_url = urljoin(base_url, f"/denki_yoho_content_data/download_csv/{filename}")
-        elif area == "kansai":
-            filename = f"{year}{date.month:02d}_jisseki.zip"
-            zip_url = urljoin(base_url, f"yamasou/{filename}")
+
+def _end_of_month(date):
+    return _month_end(date.year, date.month)
+
+
+def _end_of_quarter(date):
+    return _month_end(date.year, _quarter_months(date)[1])
+
+
+def _end_of_year(date):
+    return dt.date(date.year, 12, 31)
+
+
+def _marker_path(target_dir, name):
+    """Return the file recording the download of the CSV or archive ``name``."""
+    return f"{target_dir}/.{name}.done"
+
+
+def _write_marker(target_dir, name, paths, last_modified=None):
+    """Record that ``paths`` were saved from ``name`` just now and return them.
+
+    The time is kept in the marker rather than taken from file modification
+    times, which a git checkout of committed CSV files resets.
+    """
+    record = {"saved_at": time.time(), "last_modified": last_modified, "paths": paths}
+    with open(_marker_path(target_dir, name), "w", encoding="utf-8") as marker:
+        json.dump(record, marker)
+    return paths
+
+
+def _read_marker(target_dir, name):
+    """Return the record of an earlier download of ``name``, or ``None``.
+
+    Files without a readable record, such as those committed to the
+    repository, count as not downloaded, and so do records whose files
+    were deleted or emptied since.
+    """
+    try:
+        with open(_marker_path(target_dir, name), encoding="utf-8") as marker:
+            record = json.load(marker)
+    except (FileNotFoundError, ValueError):
+        return None
+    return record if _files_present(record["paths"]) else None
+
+
+def _files_present(paths):
+    """Whether all ``paths`` exist as non-empty files."""
+    for path in paths:
+        try:
+            if not os.stat(path).st_size:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def _revalidated(target_dir, name, record):
+    """Record that the server confirmed the saved ``name`` is unchanged."""
+    return _write_marker(target_dir, name, record["paths"], record.get("last_modified"))
+
+
+def _is_final(record, period_end):
+    """Whether the files of a download ``record`` can no longer change.
+
+    Published files keep growing until the period they cover is over, so
+    only files downloaded more than a day after it are final.
+    """
+    saved_on = dt.date.fromtimestamp(record["saved_at"])
+    return saved_on > period_end + dt.timedelta(days=1)
+
+
+def _conditional_headers(record):
+    """Return headers asking the server to skip unchanged content.
+
+    The server's own ``Last-Modified`` value is preferred, so the comparison
+    does not depend on the local clock.
+    """
+    if record is None:
+        return {}
+    since = record.get("last_modified") or formatdate(record["saved_at"], usegmt=True)
+    return {"If-Modified-Since": since}
+
+
+def _write_cleaned(src, dst, cleanup):
+    """Write the CSV file object ``src`` to ``dst`` as cleaned UTF-8.
+
+    The file is processed in chunks cut at line ends. Trailing blank lines
+    are carried over to the next chunk so ``cleanup`` always sees complete
+    runs of blank lines.
+    """
+    chunk = src.read(_CHUNK_SIZE)
+    encoding = None
+    if chunk.startswith(codecs.BOM_UTF8):
+        chunk = chunk[len(codecs.BOM_UTF8):] or src.read(_CHUNK_SIZE)
+        encoding = "utf-8"
+
+    partial = b""  # incomplete last line, still in the source encoding
+    carry = b""  # trailing blank lines, already UTF-8
+    written = False
+    while True:
+        data = partial + chunk
+        if chunk:
+            cut = data.rfind(b"\n") + 1
+            data, partial = data[:cut], data[cut:]
+        if encoding is None and not data.isascii():
+            # ASCII reads the same in UTF-8 and cp932, so the encoding is
+            # sniffed from the first other byte onwards.
+            start = _NON_ASCII.search(data).start()
+            encoding = _sniff_encoding(data[start:start + _SNIFF_SIZE])
+
+        data = carry + _recode(data, encoding)
+        if chunk:
+            data, carry = _split_blank_tail(data)
+        if data:
+            cleaned = cleanup(data)
+            dst.write(cleaned)
+            written = written or bool(cleaned)
+        if not chunk:
+            break
+        chunk = src.read(_CHUNK_SIZE)
+
+    if not written:
+        dst.write(b"\n")
+
+
+def _split_blank_tail(data):
+    """Split line-aligned ``data`` in front of its trailing blank lines."""
+    end = len(data)
+    while end:
+        start = data.rfind(b"\n", 0, end - 1) + 1
+        if not _BLANK_LINE.fullmatch(data, start, end):
+            break
+        end = start
+    return data[:end], data[end:]
+
+
+def _recode(data, encoding):
+    """Return line-aligned ``data`` in ``encoding`` re-encoded as UTF-8.
+
+    ``None`` stands for ASCII data, which needs no conversion. UTF-8 data is
+    only validated; like :func:`_decode`, invalid bytes are replaced.
+    """
+    if encoding is None:
+        return data
+    if encoding == "utf-8":
+        try:
+            data.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
         else:
-            start_months = {1: 1, 2: 1, 3: 1, 4: 4, 5: 4, 6: 4, 7: 7, 8: 7, 9: 7, 10: 10, 11: 10, 12: 10}
-            end_months = {1: 3, 2: 3, 3: 3, 4: 6, 5: 6, 6: 6, 7: 9, 8: 9, 9: 9, 10: 12, 11: 12, 12: 12}
+            return data
+    return data.decode(encoding, errors="replace").encode("utf-8")
 
-            start_month = start_months[date.month]
-            end_month = end_months[date.month]
 
-            filename = f"{year}{start_month:02d}-{end_month:02d}_{area}_denkiyohou.zip"
+def _strip_blank_lines(data):
+    """Remove all blank lines from UTF-8 ``data`` and end it with a newline."""
+    data = data.replace(b"\r\n", b"\n")
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    return _BLANK_LINE.sub(b"", data)
 
-            page_url = urljoin(base_url, "area_download.html")
-            res = requests.get(page_url)
-            res.raise_for_status()
-            html = res.text
 
-            pattern = re.escape(f"area/data/zip/{filename}")
-            match = re.search(pattern, html)
-            if not match:
-                raise ValueError(f"No data link found for {date}")
-            href = match.group(0)
-            zip_url = urljoin(base_url, href)
+def _collapse_single_blank_lines(data):
+    """Drop isolated blank lines but keep runs of two or more as empty lines."""
+    data = data.replace(b"\r\n", b"\n")
+    if not data.endswith(b"\n"):
+        data += b"\n"
+    return _BLANK_RUN.sub(_keep_blank_run, data)
 
-        zres = requests.get(zip_url, headers={"User-Agent": "Mozilla/5.0"})
-        zres.raise_for_status()
 
-        area_map = {"hokkaido": "hok", "tokyo": "tok", "chubu": "chb", "kansai": "kas"}
-        area_path = area_map.get(area, area)
-        target_dir = Path("csv") / "juyo" / area_path / f"{year}"
-        target_dir.mkdir(parents=True, exist_ok=True)
+def _keep_blank_run(match):
+    count = match.group().count(b"\n")
+    return b"\n" * count if count > 1 else b""
+
+
+def _to_utf8(data):
+    """Return CSV bytes re-encoded as UTF-8 without a byte order mark.
+
+    UTF-8 input is only validated, so it is never decoded into a string.
+    """
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:
+        return _decode(data).encode("utf-8")
+    return data.removeprefix(codecs.BOM_UTF8)
+
+
+def _decode(data):
+    """Decode CSV bytes published as UTF-8 or Shift_JIS.
+
+    UTF-8 is tried first since Shift_JIS text practically never passes a
+    strict UTF-8 decode, whereas UTF-8 text often decodes as cp932 mojibake.
+    Anything else falls back to detection on the leading bytes, using
+    ``cchardet`` when installed and ``charset_normalizer`` otherwise.
+    """
+    for encoding in ("utf-8-sig", "cp932"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    encoding = _detect_encoding(data[:_SNIFF_SIZE])
+    return data.decode(encoding, errors="replace")
 
-        extracted_files: list[str] = []
-        with ZipFile(BytesIO(zres.content)) as zf:
-            for member in zf.infolist():
-                if member.is_dir():
-                    continue
-                name = Path(member.filename).name
-                dest_path = target_dir / name
-                with zf.open(member) as src:
-                    data = src.read()
-
-                encoding = (chardet.detect(data).get("encoding") or "").lower()
-                text = data.decode(encoding)
-                if area == "tokyo":
-                    # Remove only single blank lines while keeping groups of
-                    # consecutive blank lines intact. This avoids altering
-                    # blocks that use multiple blank lines as separators.
-                    lines = text.splitlines()
-                    cleaned: list[str] = []
-                    i = 0
-                    while i < len(lines):
-                        if not lines[i].strip():
-                            j = i
-                            while j < len(lines) and not lines[j].strip():
-                                j += 1
-                            if j - i > 1:
-                                cleaned.extend([""] * (j - i))
-                            i = j
-                            continue
-                        cleaned.append(lines[i])
-                        i += 1
-                    text = "\n".join(cleaned) + "\n"
-                elif area in {"hokkaido", "chubu", "kansai"}:
-                    # Remove all empty lines
-                    lines = [line for line in text.splitlines() if line.strip()]
-                    text = "\n".join(lines) + "\n"
-                with open(dest_path, "w", encoding="utf-8") as dst:
-                    dst.write(text)
-                extracted_files.append(str(dest_path))
-
-        return extracted_files
+
+def _sniff_encoding(sample):
+    """Return the encoding of CSV data starting with ``sample``.
+
+    Like :func:`_decode`, UTF-8 is tried before cp932, and detection is
+    the fallback. ``sample`` may end in the middle of a character.
+    """
+    for encoding in ("utf-8", "cp932"):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    return _detect_encoding(sample)
+
+
+def _detect_encoding(sample):
+    """Detect the encoding of ``sample``, defaulting to cp932."""
+    return detect(sample).get("encoding") or "cp932"
+
+
+def _to_date(date):
+    """Normalize ``date`` to :class:`datetime.date`."""
+    if isinstance(date, str):
+        return dt.date.fromisoformat(date)
+    if isinstance(date, dt.datetime):
+        return date.date()
+    if not isinstance(date, dt.date):
+        raise TypeError("date must be a date, datetime, or ISO format string")
+    return date
+
+
+@dataclass(frozen=True)
+class AreaSpec:
+    """How an area publishes its demand data and where it is saved.
+
+    Attributes
+    ----------
+    url_builder : callable
+        Returns the path of the file published for a date, relative to the
+        area's base URL. Its last segment is the CSV or ZIP archive name.
+    period_end : callable
+        Returns the last day covered by the file published for a date.
+    subdir : str
+        Directory under ``csv/juyo`` the files are saved in.
+    yearly : bool
+        Whether files are grouped in per-year subdirectories.
+    cleanup : callable
+        Blank-line cleanup applied to the UTF-8 bytes of each CSV file.
+    landing_page : str or None
+        Page, relative to the base URL, that must link the file before it is
+        downloaded.
+    """
+
+    url_builder: Callable[[dt.date], str]
+    period_end: Callable[[dt.date], dt.date]
+    subdir: str
+    yearly: bool = True
+    cleanup: Callable[[bytes], bytes] = _strip_blank_lines
+    landing_page: str | None = None
+
+
+_AREA_HANDLERS = {
+    "hokkaido": AreaSpec(
+        _hokkaido_path, _end_of_quarter, "hok", landing_page="area_download.html"
+    ),
+    "tohoku": AreaSpec(_TOHOKU_CSV_TMPL.format, _end_of_year, "toh", yearly=False),
+    # Remove only single blank lines while keeping groups of consecutive
+    # blank lines intact. This avoids altering blocks that use multiple
+    # blank lines as separators.
+    "tokyo": AreaSpec(
+        _TOKYO_ZIP_TMPL.format, _end_of_month, "tok", cleanup=_collapse_single_blank_lines
+    ),
+    "chubu": AreaSpec(_CHUBU_ZIP_TMPL.format, _end_of_month, "chb"),
+    "chugoku": AreaSpec(_CHUGOKU_CSV_TMPL.format, _end_of_year, "cgk"),
+    "hokuriku": AreaSpec(_HOKURIKU_CSV_TMPL.format, _end_of_day, "hrk"),
+    "kansai": AreaSpec(_KANSAI_ZIP_TMPL.format, _end_of_month, "kas"),
+    "shikoku": AreaSpec(_SHIKOKU_CSV_TMPL.format, _end_of_year, "shi", yearly=False),
+    "kyushu": AreaSpec(_KYUSHU_CSV_TMPL.format, _end_of_day, "kyu"),
+    "okinawa": AreaSpec(_OKINAWA_CSV_TMPL.format, _end_of_day, "oki"),
+}
+# Tokyo's yearly CSV files, published for dates before ``_TOKYO_ZIP_START``.
+_TOKYO_YEARLY = AreaSpec(_TOKYO_CSV_TMPL.format, _end_of_year, "tok", yearly=False)
 
 
 if __name__ == "__main__":
@@ -319,58 +744,59 @@ if __name__ == "__main__":
     from dateutil.relativedelta import relativedelta
 
     scraper = epco()
+    today = date.today()
 
     for k in range(15):
-        months_ago = date.today() - relativedelta(years=4 + 1 * k)
+        months_ago = today - relativedelta(years=4 + 1 * k)
         result = scraper.juyo(months_ago, "tokyo")
         print(f"{months_ago}: {result}")
 
     # for k in range(15):
-    #     months_ago = date.today() - relativedelta(years=1 * k)
+    #     months_ago = today - relativedelta(years=1 * k)
     #     result = scraper.juyo(months_ago, "chugoku")
     #     print(f"{months_ago}: {result}")
 
     # for k in range(365*15):
-    #     months_ago = date.today() - relativedelta(days=1 * k)
+    #     months_ago = today - dt.timedelta(days=k)
     #     result = scraper.juyo(months_ago, "okinawa")
     #     print(f"{months_ago}: {result}")
 
     # for k in range(365*15):
-    #     months_ago = date.today() - relativedelta(days=1 * k)
+    #     months_ago = today - dt.timedelta(days=k)
     #     result = scraper.juyo(months_ago, "kyushu")
     #     print(f"{months_ago}: {result}")
 
     # for k in range(12):
-    #     months_ago = date.today() - relativedelta(years=1 * k)
+    #     months_ago = today - relativedelta(years=1 * k)
     #     result = scraper.juyo(months_ago, "shikoku")
     #     print(f"{months_ago}: {result}")
 
     # for k in range(120):
-    #     months_ago = date.today() - relativedelta(months=1 * k)
+    #     months_ago = today - relativedelta(months=1 * k)
     #     result = scraper.juyo(months_ago, "kansai")
     #     print(f"{months_ago}: {result}")
 
-    # for k in range(365*10):
-    #     months_ago = date.today() - relativedelta(days=1 * k)
-    #     result = scraper.juyo(months_ago, "hokuriku")
-    #     print(f"{months_ago}: {result}")
+    # days = [today - dt.timedelta(days=k) for k in range(365*10)]
+    # results = asyncio.run(scraper.juyo_batch(days, "hokuriku"))
+    # for day, result in zip(days, results):
+    #     print(f"{day}: {result}")
 
     # for k in range(84):
-    #     months_ago = date.today() - relativedelta(months=1 * k)
+    #     months_ago = today - relativedelta(months=1 * k)
     #     result = scraper.juyo(months_ago, "chubu")
     #     print(f"{months_ago}: {result}")
 
     # for k in range(48):
-    #     months_ago = date.today() - relativedelta(months=1 * k)
+    #     months_ago = today - relativedelta(months=1 * k)
     #     result = scraper.juyo(months_ago, "tokyo")
     #     print(f"{months_ago}: {result}")
 
     # for k in range(11):
-    #     months_ago = date.today() - relativedelta(months=12 * k)
+    #     months_ago = today - relativedelta(months=12 * k)
     #     result = scraper.juyo(months_ago, "tohoku")
     #     print(f"{months_ago}: {result}")
 
     # for k in range(30):
-    #     months_ago = date.today() - relativedelta(months=3 * k)
+    #     months_ago = today - relativedelta(months=3 * k)
     #     result = scraper.juyo(months_ago, "hokkaido")
     #     print(f"{months_ago}: {result}")
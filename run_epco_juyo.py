@@ -1,4 +1,7 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from itertools import repeat
+import os
 import sys
 
 from epco_scraper import epco
@@ -17,16 +20,30 @@ AREAS = [
     "okinawa",
 ]
 
+# Scraper of the current worker process, created by ``_init_worker``.
+_scraper = None
+
+
+def _init_worker():
+    # Give every process its own scraper and HTTP session.
+    global _scraper
+    _scraper = epco()
+
+
+def _worker(date, area):
+    return _scraper.juyo(date=date, area=area)
+
 
 if __name__ == "__main__":
     yesterday = datetime.today() - timedelta(days=1)
+    date = yesterday.strftime("%Y%m%d")
 
-    scraper = epco()
-    for area in AREAS:
+    max_workers = min(len(AREAS), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as ex:
         try:
-            paths = scraper.juyo(date=yesterday.strftime("%Y%m%d"), area=area)
-            for path in paths:
-                print(path)
+            for paths in ex.map(_worker, repeat(date), AREAS):
+                for path in paths:
+                    print(path)
         except RuntimeError as err:
             print(err)
             sys.exit(1)